@@ -431,20 +431,23 @@ class PosReadsInfo:
     @cython.ccall
     def call_GT(self, max_allowed_ar: cython.float = 0.99):
         """Require update_top_alleles being called."""
-        top1_bq_T: cnp.ndarray(cython.int, ndim=1)
-        top2_bq_T: cnp.ndarray(cython.int, ndim=1)
-        top1_bq_C: cnp.ndarray(cython.int, ndim=1)
-        top2_bq_C: cnp.ndarray(cython.int, ndim=1)
+        top1_bq_T: cnp.ndarray(cython.uchar, ndim=1)
+        top2_bq_T: cnp.ndarray(cython.uchar, ndim=1)
+        top1_bq_C: cnp.ndarray(cython.uchar, ndim=1)
+        top2_bq_C: cnp.ndarray(cython.uchar, ndim=1)
         tmp_mutation_type: list
         tmp_alt: cython.bytes
 
         if self.filterout:
             return
 
-        top1_bq_T = np.array(self.bq_set_T[self.top1allele], dtype="i4")
-        top2_bq_T = np.array(self.bq_set_T[self.top2allele], dtype="i4")
-        top1_bq_C = np.array(self.bq_set_C[self.top1allele], dtype="i4")
-        top2_bq_C = np.array(self.bq_set_C[self.top2allele], dtype="i4")
+        # base qualities are single bytes from the BAM file; the
+        # conversion to uint8 raises OverflowError for anything else,
+        # so VariantStat can index its tables without checks
+        top1_bq_T = np.array(self.bq_set_T[self.top1allele], dtype="u1")
+        top2_bq_T = np.array(self.bq_set_T[self.top2allele], dtype="u1")
+        top1_bq_C = np.array(self.bq_set_C[self.top1allele], dtype="u1")
+        top2_bq_C = np.array(self.bq_set_C[self.top2allele], dtype="u1")
         (self.lnL_homo_major, self.BIC_homo_major) = CalModel_Homo(
             top1_bq_T, top1_bq_C, top2_bq_T, top2_bq_C
         )
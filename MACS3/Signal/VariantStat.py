@@ -1,5 +1,5 @@
-# cython: language_level=3
-# cython: profile=True
+# cython: language_level=3, profile=False, boundscheck=False, wraparound=False
+# cython: cdivision=True, initializedcheck=False, cpow=True, infer_types=True
 # Time-stamp: <2024-10-22 14:47:22 Tao Liu>
 
 """Module for SAPPER BAMParser class
@@ -21,54 +21,63 @@ with the distribution).
 # ------------------------------------
 import cython
 
-import cython.cimports.numpy as cnp
-from cython.cimports.cpython import bool
+import numpy as np
 
-from math import log1p, exp, log
+# ------------------------------------
+# C lib
+# ------------------------------------
+from cython.cimports.libc.math import exp, expm1, log, lgamma, fmin, fmax
+
+LN10 = cython.declare(cython.double, 2.3025850929940458)
+LN10_tenth = cython.declare(cython.double, 0.23025850929940458)
 
-LN10 = 2.3025850929940458
-LN10_tenth = 0.23025850929940458
+# Base qualities come from BAM quality bytes, so a Phred score can
+# only take 256 values. Tabulate the error rate E = exp(Phred *
+# -LN10_tenth) and log(1-E) once instead of calling exp/log1p per
+# base. 1-E is taken as -expm1(Phred * -LN10_tenth) so that it keeps
+# its precision for low Phred scores, where E is close to 1; for
+# Phred 0 it is log(0) = -inf. Every uchar is a valid index, so the
+# loops over the Phred scores need no bounds check.
+E_TABLE = cython.declare(cython.double[256])
+LOG1P_M_E = cython.declare(cython.double[256])
+for _q in range(256):
+    E_TABLE[_q] = exp(-_q * LN10_tenth)
+    LOG1P_M_E[_q] = log(-expm1(-_q * LN10_tenth))
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
 @cython.ccall
 def CalModel_Homo(
-    top1_bq_T: cnp.ndarray(cython.int, ndim=1),
-    top1_bq_C: cnp.ndarray(cython.int, ndim=1),
-    top2_bq_T: cnp.ndarray(cython.int, ndim=1),
-    top2_bq_C: cnp.ndarray(cython.int, ndim=1),
+    top1_bq_T: cython.uchar[::1],
+    top1_bq_C: cython.uchar[::1],
+    top2_bq_T: cython.uchar[::1],
+    top2_bq_C: cython.uchar[::1],
 ) -> tuple:
     """Return (lnL, BIC)."""
-    i: cython.int
     lnL: cython.double
     BIC: cython.double
 
-    lnL = 0
-    # Phred score is Phred = -10log_{10} E, where E is the error rate.
-    # to get the 1-E: 1-E = 1-exp(Phred/-10*M_LN10) = 1-exp(Phred * -LOG10_E_tenth)
-    for i in range(top1_bq_T.shape[0]):
-        lnL += log1p(-exp(-top1_bq_T[i] * LN10_tenth))
-    for i in range(top1_bq_C.shape[0]):
-        lnL += log1p(-exp(-top1_bq_C[i] * LN10_tenth))
-
-    for i in range(top2_bq_T.shape[0]):
-        lnL += log(exp(-top2_bq_T[i] * LN10_tenth))
-    for i in range(top2_bq_C.shape[0]):
-        lnL += log(exp(-top2_bq_C[i] * LN10_tenth))
+    with cython.nogil:
+        # Phred score is Phred = -10log_{10} E, where E is the error rate.
+        # to get the 1-E:
+        # 1-E = 1-exp(Phred/-10*M_LN10) = 1-exp(Phred * -LOG10_E_tenth)
+        # and log(E) = Phred * -LN10_tenth, so the top2 terms only need
+        # the sum of the Phred scores
+        lnL = (
+            sum_log1p_m_e(top1_bq_T)
+            + sum_log1p_m_e(top1_bq_C)
+            - LN10_tenth * (sum_phred(top2_bq_T) + sum_phred(top2_bq_C))
+        )
 
     BIC = -2 * lnL  # no free variable, no penalty
     return (lnL, BIC)
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
 @cython.ccall
 def CalModel_Heter_noAS(
-    top1_bq_T: cnp.ndarray(cython.int, ndim=1),
-    top1_bq_C: cnp.ndarray(cython.int, ndim=1),
-    top2_bq_T: cnp.ndarray(cython.int, ndim=1),
-    top2_bq_C: cnp.ndarray(cython.int, ndim=1),
+    top1_bq_T: cython.uchar[::1],
+    top1_bq_C: cython.uchar[::1],
+    top2_bq_T: cython.uchar[::1],
+    top2_bq_C: cython.uchar[::1],
 ) -> tuple:
     """Return (lnL, BIC)
 
@@ -84,31 +93,48 @@ def CalModel_Heter_noAS(
     # tn: cython.int  # total observed NTs
     lnL_T: cython.double
     lnL_C: cython.double  # log likelihood for treatment and control
+    e: cython.double[::1]  # error rates, shared by treatment and control
 
     lnL = 0
     BIC = 0
     # for k_T
     # total oberseved treatment reads from top1 and top2 NTs
     tn_T = top1_bq_T.shape[0] + top2_bq_T.shape[0]
+    tn_C = top1_bq_C.shape[0] + top2_bq_C.shape[0]
+    e = np.empty(2 * max(tn_T, tn_C), dtype="f8")
 
     if tn_T == 0:
         raise Exception("Total number of treatment reads is 0!")
     else:
-        (lnL_T, k_T) = GreedyMaxFunctionNoAS(
-            top1_bq_T.shape[0], top2_bq_T.shape[0], tn_T, top1_bq_T, top2_bq_T
-        )
+        if GreedyMaxFunctionNoAS(
+            top1_bq_T.shape[0],
+            top2_bq_T.shape[0],
+            tn_T,
+            top1_bq_T,
+            top2_bq_T,
+            e,
+            cython.address(lnL_T),
+            cython.address(k_T),
+        ):
+            raise Exception("error in GreedyMaxFunctionNoAS")
         lnL += lnL_T
         BIC += -2 * lnL_T
 
     # for k_C
-    tn_C = top1_bq_C.shape[0] + top2_bq_C.shape[0]
-
     if tn_C == 0:
         pass
     else:
-        (lnL_C, k_C) = GreedyMaxFunctionNoAS(
-            top1_bq_C.shape[0], top2_bq_C.shape[0], tn_C, top1_bq_C, top2_bq_C
-        )
+        if GreedyMaxFunctionNoAS(
+            top1_bq_C.shape[0],
+            top2_bq_C.shape[0],
+            tn_C,
+            top1_bq_C,
+            top2_bq_C,
+            e,
+            cython.address(lnL_C),
+            cython.address(k_C),
+        ):
+            raise Exception("error in GreedyMaxFunctionNoAS")
         lnL += lnL_C
         BIC += -2 * lnL_C
 
@@ -125,14 +151,12 @@ def CalModel_Heter_noAS(
     return (lnL, BIC)
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
 @cython.ccall
 def CalModel_Heter_AS(
-    top1_bq_T: cnp.ndarray(cython.int, ndim=1),
-    top1_bq_C: cnp.ndarray(cython.int, ndim=1),
-    top2_bq_T: cnp.ndarray(cython.int, ndim=1),
-    top2_bq_C: cnp.ndarray(cython.int, ndim=1),
+    top1_bq_T: cython.uchar[::1],
+    top1_bq_C: cython.uchar[::1],
+    top2_bq_T: cython.uchar[::1],
+    top2_bq_C: cython.uchar[::1],
     max_allowed_ar: cython.float = 0.99,
 ) -> tuple:
     """Return (lnL, BIC)
@@ -151,38 +175,52 @@ def CalModel_Heter_AS(
     lnL_T: cython.double
     lnL_C: cython.double  # log likelihood for treatment and control
     AS_alleleratio: cython.double  # allele ratio
+    e: cython.double[::1]  # error rates, shared by treatment and control
 
     lnL = 0
     BIC = 0
 
     # Treatment
     tn_T = top1_bq_T.shape[0] + top2_bq_T.shape[0]
+    tn_C = top1_bq_C.shape[0] + top2_bq_C.shape[0]
+    e = np.empty(2 * max(tn_T, tn_C), dtype="f8")
 
     if tn_T == 0:
         raise Exception("Total number of treatment reads is 0!")
     else:
-        (lnL_T, k_T, AS_alleleratio) = GreedyMaxFunctionAS(
+        if GreedyMaxFunctionAS(
             top1_bq_T.shape[0],
             top2_bq_T.shape[0],
             tn_T,
             top1_bq_T,
             top2_bq_T,
+            e,
             max_allowed_ar,
-        )
+            cython.address(lnL_T),
+            cython.address(k_T),
+            cython.address(AS_alleleratio),
+        ):
+            raise Exception("error in GreedyMaxFunctionAS")
         # print ">>>",lnL_T, k_T, AS_alleleratio
         lnL += lnL_T
         BIC += -2 * lnL_T
 
     # control
-    tn_C = top1_bq_C.shape[0] + top2_bq_C.shape[0]
-
     if tn_C == 0:
         pass
     else:
         # We assume control will not have allele preference
-        (lnL_C, k_C) = GreedyMaxFunctionNoAS(
-            top1_bq_C.shape[0], top2_bq_C.shape[0], tn_C, top1_bq_C, top2_bq_C
-        )
+        if GreedyMaxFunctionNoAS(
+            top1_bq_C.shape[0],
+            top2_bq_C.shape[0],
+            tn_C,
+            top1_bq_C,
+            top2_bq_C,
+            e,
+            cython.address(lnL_C),
+            cython.address(k_C),
+        ):
+            raise Exception("error in GreedyMaxFunctionNoAS")
         lnL += lnL_C
         BIC += -2 * lnL_C
 
@@ -197,18 +235,88 @@ def CalModel_Heter_AS(
     return (lnL, BIC)
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
 @cython.cfunc
+@cython.nogil
+@cython.exceptval(check=False)
+def tabulate_error_rates(
+    bq: cython.uchar[::1], e: cython.double[::1], w: cython.double[::1]
+) -> cython.int:
+    """Store the error rate of each distinct Phred score in bq in e and
+    the number of bases with that score in w. Return the number of
+    distinct Phred scores.
+
+    Bases with the same Phred score add the same term to calculate_ln
+    for a given k, so the greedy searches tabulate them once and then
+    evaluate each k over the distinct scores only.
+    """
+    i: cython.int
+    j: cython.int
+    q: cython.uchar
+    slot: cython.int[256]  # 1 + index of q in e and w, 0 if not seen
+
+    for i in range(256):
+        slot[i] = 0
+
+    j = 0
+    for i in range(bq.shape[0]):
+        q = bq[i]
+        if slot[q] == 0:
+            e[j] = E_TABLE[q]
+            w[j] = 0
+            j += 1
+            slot[q] = j
+        w[slot[q] - 1] += 1
+    return j
+
+
+@cython.cfunc
+@cython.inline
+@cython.nogil
+@cython.exceptval(check=False)
+def sum_log1p_m_e(bq: cython.uchar[::1]) -> cython.double:
+    """Return the sum of log(1-E) over the Phred scores in bq."""
+    i: cython.int
+    s: cython.double = 0
+
+    for i in range(bq.shape[0]):
+        s += LOG1P_M_E[bq[i]]
+    return s
+
+
+@cython.cfunc
+@cython.inline
+@cython.nogil
+@cython.exceptval(check=False)
+def sum_phred(bq: cython.uchar[::1]) -> cython.long:
+    """Return the sum of the Phred scores in bq."""
+    i: cython.int
+    s: cython.long = 0
+
+    for i in range(bq.shape[0]):
+        s += bq[i]
+    return s
+
+
+@cython.cfunc
+@cython.nogil
+@cython.exceptval(check=False)
 def GreedyMaxFunctionAS(
     m: cython.int,
     n: cython.int,
     tn: cython.int,
-    me: cnp.ndarray(cython.int, ndim=1),
-    ne: cnp.ndarray(cython.int, ndim=1),
-    max_allowed_ar: cython.float = 0.99,
-) -> tuple:
-    """Return lnL, k and alleleratio in tuple.
+    me: cython.uchar[::1],
+    ne: cython.uchar[::1],
+    e: cython.double[::1],
+    max_allowed_ar: cython.float,
+    out_lnL: cython.pointer(cython.double),
+    out_k: cython.pointer(cython.int),
+    out_ar: cython.pointer(cython.double),
+) -> cython.int:
+    """Find lnL, k and alleleratio, and store them in out_lnL, out_k
+    and out_ar. Return 0, or -1 if the search fails.
+
+    e is a scratch buffer of at least 2*tn doubles for the tabulated
+    error rates of me and ne (see tabulate_error_rates).
 
     Note: I only translate Liqing's C++ code into pyx here. Haven't
     done any review.
@@ -220,55 +328,94 @@ def GreedyMaxFunctionAS(
     rnew: cython.double
     kold: cython.int
     knew: cython.int
-    btemp: bool
+    btemp: cython.bint
     k0: cython.int
     dl: cython.double
     dr: cython.double
     d0: cython.double
     d1l: cython.double
     d1r: cython.double
+    dm: cython.int
+    dn: cython.int
+    e_m: cython.double[::1]
+    w_m: cython.double[::1]
+    e_n: cython.double[::1]
+    w_n: cython.double[::1]
 
-    assert m + n == tn
     btemp = False
+    # e[:2*m] holds the error rates and counts of me, e[2*m:2*tn] of ne
+    dm = tabulate_error_rates(me, e[:m], e[m : 2 * m])
+    dn = tabulate_error_rates(ne, e[2 * m : m + tn], e[m + tn : 2 * tn])
+    e_m = e[:dm]
+    w_m = e[m : m + dm]
+    e_n = e[2 * m : 2 * m + dn]
+    w_n = e[m + tn : m + tn + dn]
+
     if tn == 1:  # only 1 read; I don't expect this to be run...
-        dl = calculate_ln(m, n, tn, me, ne, 0, 0)
-        dr = calculate_ln(m, n, tn, me, ne, 1, 1)
+        dl = calculate_ln(tn, e_m, w_m, e_n, w_n, 0, 0)
+        dr = calculate_ln(tn, e_m, w_m, e_n, w_n, 1, 1)
 
         if dl > dr:
-            k = 0
-            return (dl, 0, 0)
+            out_lnL[0] = dl
+            out_k[0] = 0
+            out_ar[0] = 0
         else:
-            k = 1
-            return (dr, 1, 1)
+            out_lnL[0] = dr
+            out_k[0] = 1
+            out_ar[0] = 1
+        return 0
     elif m == 0:  # no top1 nt
-        return (
-            calculate_ln(m, n, tn, me, ne, 0, m, max_allowed_ar),
-            m,
-            1 - max_allowed_ar,
-        )
+        out_lnL[0] = calculate_ln(tn, e_m, w_m, e_n, w_n, 0, m, max_allowed_ar)
+        out_k[0] = m
+        out_ar[0] = 1 - max_allowed_ar
+        return 0
         # k0 = m + 1
     elif m == tn:  # all reads are top1
-        return (calculate_ln(m, n, tn, me, ne, 1, m, max_allowed_ar), m, max_allowed_ar)
+        out_lnL[0] = calculate_ln(tn, e_m, w_m, e_n, w_n, 1, m, max_allowed_ar)
+        out_k[0] = m
+        out_ar[0] = max_allowed_ar
+        return 0
     else:
         k0 = m
 
-    d0 = calculate_ln(m, n, tn, me, ne, float(k0) / tn, k0, max_allowed_ar)
-    d1l = calculate_ln(m, n, tn, me, ne, float(k0 - 1) / tn, k0 - 1, max_allowed_ar)
-    d1r = calculate_ln(m, n, tn, me, ne, float(k0 + 1) / tn, k0 + 1, max_allowed_ar)
+    d0 = calculate_ln(
+        tn, e_m, w_m, e_n, w_n, cython.cast(cython.double, k0) / tn, k0, max_allowed_ar
+    )
+    d1l = calculate_ln(
+        tn,
+        e_m,
+        w_m,
+        e_n,
+        w_n,
+        cython.cast(cython.double, k0 - 1) / tn,
+        k0 - 1,
+        max_allowed_ar,
+    )
+    d1r = calculate_ln(
+        tn,
+        e_m,
+        w_m,
+        e_n,
+        w_n,
+        cython.cast(cython.double, k0 + 1) / tn,
+        k0 + 1,
+        max_allowed_ar,
+    )
 
     if d0 > d1l - 1e-8 and d0 > d1r - 1e-8:
-        k = k0
-        ar = float(k0) / tn
-        return (d0, k, ar)
+        out_lnL[0] = d0
+        out_k[0] = k0
+        out_ar[0] = cython.cast(cython.double, k0) / tn
+        return 0
     elif d1l > d0:
         dold = d1l
         kold = k0 - 1
-        rold = float(k0 - 1) / tn
+        rold = cython.cast(cython.double, k0 - 1) / tn
         while kold > 1:  # disable: when kold=1 still run, than knew=0 is the final run
             knew = kold - 1
-            rnew = float(knew) / tn
+            rnew = cython.cast(cython.double, knew) / tn
 
-            dnew = calculate_ln(m, n, tn, me, ne, rnew, knew, max_allowed_ar)
+            dnew = calculate_ln(tn, e_m, w_m, e_n, w_n, rnew, knew, max_allowed_ar)
 
             if dnew - 1e-8 < dold:
                 btemp = True
@@ -277,27 +424,25 @@ def GreedyMaxFunctionAS(
             dold = dnew
             rold = rnew
 
-        if btemp:  # maximum L value is in [1,m-1];
-            k = kold
-            ar = rold
-            return (dold, k, ar)
-        else:  # L(k=0) is the max for [0,m-1]
-            k = kold
-            ar = rold
-            return (dold, k, ar)
+        # if btemp, maximum L value is in [1,m-1];
+        # otherwise L(k=0) is the max for [0,m-1]
+        out_lnL[0] = dold
+        out_k[0] = kold
+        out_ar[0] = rold
+        return 0
 
     elif d1r > d0:
         dold = d1r
         kold = k0 + 1
-        rold = float(k0 + 1) / tn
+        rold = cython.cast(cython.double, k0 + 1) / tn
         while (
             kold < tn - 1
         ):  # //disable: when kold=tn-1 still run, than knew=tn is the final run
             knew = kold + 1
 
-            rnew = float(knew) / tn
+            rnew = cython.cast(cython.double, knew) / tn
 
-            dnew = calculate_ln(m, n, tn, me, ne, rnew, knew, max_allowed_ar)
+            dnew = calculate_ln(tn, e_m, w_m, e_n, w_n, rnew, knew, max_allowed_ar)
 
             if dnew - 1e-8 < dold:
                 btemp = True
@@ -306,29 +451,34 @@ def GreedyMaxFunctionAS(
             dold = dnew
             rold = rnew
 
-        if btemp:  # maximum L value is in [m+1,tn-1]
-            k = kold
-            ar = rold
-            return (dold, k, ar)
-        else:  # L(k=tn) is the max for [m+1,tn]
-            k = kold
-            ar = rold
-            return (dold, k, ar)
+        # if btemp, maximum L value is in [m+1,tn-1]
+        # otherwise L(k=tn) is the max for [m+1,tn]
+        out_lnL[0] = dold
+        out_k[0] = kold
+        out_ar[0] = rold
+        return 0
     else:
-        raise Exception("error in GreedyMaxFunctionAS")
+        return -1
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
 @cython.cfunc
+@cython.nogil
+@cython.exceptval(check=False)
 def GreedyMaxFunctionNoAS(
     m: cython.int,
     n: cython.int,
     tn: cython.int,
-    me: cnp.ndarray(cython.int, ndim=1),
-    ne: cnp.ndarray(cython.int, ndim=1),
-) -> tuple:
-    """Return lnL, and k in tuple.
+    me: cython.uchar[::1],
+    ne: cython.uchar[::1],
+    e: cython.double[::1],
+    out_lnL: cython.pointer(cython.double),
+    out_k: cython.pointer(cython.int),
+) -> cython.int:
+    """Find lnL and k, and store them in out_lnL and out_k. Return 0,
+    or -1 if the search fails.
+
+    e is a scratch buffer of at least 2*tn doubles for the tabulated
+    error rates of me and ne (see tabulate_error_rates).
 
     Note: I only translate Liqing's C++ code into pyx here. Haven't
     done any review.
@@ -338,32 +488,48 @@ def GreedyMaxFunctionNoAS(
     dold: cython.double
     kold: cython.int
     knew: cython.int
-    btemp: bool
+    btemp: cython.bint
     k0: cython.int
     bg_r: cython.double
+    lnL_r: cython.double
     dl: cython.double
     dr: cython.double
     d0: cython.double
     d1l: cython.double
     d1r: cython.double
+    dm: cython.int
+    dn: cython.int
+    e_m: cython.double[::1]
+    w_m: cython.double[::1]
+    e_n: cython.double[::1]
+    w_n: cython.double[::1]
 
     btemp = False
     bg_r = 0.5
+    # with r = bg_r = 0.5, the k*log(r) + (tn-k)*log(1-r) term of
+    # calculate_ln is tn*log(0.5) for any k, so compute it only once
+    lnL_r = tn * log(bg_r)
 
+    # these only need k = 0 or k = tn, so skip the error rates
     if tn == 1:
-        dl = calculate_ln(m, n, tn, me, ne, bg_r, 0)
-        dr = calculate_ln(m, n, tn, me, ne, bg_r, 1)
+        dl = lnL_r + calculate_ln_edge(me, ne, True)
+        dr = lnL_r + calculate_ln_edge(me, ne, False)
         if dl > dr:
-            k = 0
-            return (dl, 0)
+            out_lnL[0] = dl
+            out_k[0] = 0
         else:
-            k = 1
-            return (dr, 1)
+            out_lnL[0] = dr
+            out_k[0] = 1
+        return 0
     elif m == 0:  # no top1 nt
-        return (calculate_ln(m, n, tn, me, ne, bg_r, m), m)
+        out_lnL[0] = lnL_r + calculate_ln_edge(me, ne, True)
+        out_k[0] = m
+        return 0
         # k0 = m + 1
     elif m == tn:  # all reads are top1
-        return (calculate_ln(m, n, tn, me, ne, bg_r, m), m)
+        out_lnL[0] = lnL_r + calculate_ln_edge(me, ne, False)
+        out_k[0] = m
+        return 0
     # elif m == 0:
     #    k0 = m + 1
     # elif m == tn:
@@ -371,31 +537,39 @@ def GreedyMaxFunctionNoAS(
     else:
         k0 = m
 
-    d0 = calculate_ln(m, n, tn, me, ne, bg_r, k0)
-    d1l = calculate_ln(m, n, tn, me, ne, bg_r, k0 - 1)
-    d1r = calculate_ln(m, n, tn, me, ne, bg_r, k0 + 1)
+    # e[:2*m] holds the error rates and counts of me, e[2*m:2*tn] of ne
+    dm = tabulate_error_rates(me, e[:m], e[m : 2 * m])
+    dn = tabulate_error_rates(ne, e[2 * m : m + tn], e[m + tn : 2 * tn])
+    e_m = e[:dm]
+    w_m = e[m : m + dm]
+    e_n = e[2 * m : 2 * m + dn]
+    w_n = e[m + tn : m + tn + dn]
+
+    d0 = lnL_r + calculate_ln_k(tn, e_m, w_m, e_n, w_n, k0)
+    d1l = lnL_r + calculate_ln_k(tn, e_m, w_m, e_n, w_n, k0 - 1)
+    d1r = lnL_r + calculate_ln_k(tn, e_m, w_m, e_n, w_n, k0 + 1)
 
     if d0 > d1l - 1e-8 and d0 > d1r - 1e-8:
-        k = k0
-        return (d0, k)
+        out_lnL[0] = d0
+        out_k[0] = k0
+        return 0
     elif d1l > d0:
         dold = d1l
         kold = k0 - 1
         while kold >= 1:  # //when kold=1 still run, than knew=0 is the final run
             knew = kold - 1
-            dnew = calculate_ln(m, n, tn, me, ne, bg_r, knew)
+            dnew = lnL_r + calculate_ln_k(tn, e_m, w_m, e_n, w_n, knew)
             if dnew - 1e-8 < dold:
                 btemp = True
                 break
             kold = knew
             dold = dnew
 
-        if btemp:  # //maximum L value is in [1,m-1];
-            k = kold
-            return (dold, k)
-        else:  # //L(k=0) is the max for [0,m-1]
-            k = kold
-            return (dold, k)
+        # if btemp, maximum L value is in [1,m-1];
+        # otherwise L(k=0) is the max for [0,m-1]
+        out_lnL[0] = dold
+        out_k[0] = kold
+        return 0
     elif d1r > d0:
         dold = d1r
         kold = k0 + 1
@@ -403,73 +577,110 @@ def GreedyMaxFunctionNoAS(
             kold <= tn - 1
         ):  # //when kold=tn-1 still run, than knew=tn is the final run
             knew = kold + 1
-            dnew = calculate_ln(m, n, tn, me, ne, bg_r, knew)
+            dnew = lnL_r + calculate_ln_k(tn, e_m, w_m, e_n, w_n, knew)
             if dnew - 1e-8 < dold:
                 btemp = True
                 break
             kold = knew
             dold = dnew
 
-        if btemp:  # //maximum L value is in [m+1,tn-1]
-            k = kold
-            return (dold, k)
-        else:  # //L(k=tn) is the max for [m+1,tn]
-            k = kold
-            return (dold, k)
+        # if btemp, maximum L value is in [m+1,tn-1]
+        # otherwise L(k=tn) is the max for [m+1,tn]
+        out_lnL[0] = dold
+        out_k[0] = kold
+        return 0
     else:
-        raise Exception("error in GreedyMaxFunctionNoAS")
+        return -1
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
 @cython.cfunc
+@cython.inline
+@cython.nogil
+@cython.exceptval(check=False)
 def calculate_ln(
-    m: cython.int,
-    n: cython.int,
     tn: cython.int,
-    me: cnp.ndarray(cython.int, ndim=1),
-    ne: cnp.ndarray(cython.int, ndim=1),
+    e_m: cython.double[::1],
+    w_m: cython.double[::1],
+    e_n: cython.double[::1],
+    w_n: cython.double[::1],
     r: cython.double,
     k: cython.int,
     max_allowed_r: cython.float = 0.99,
-):
-    """Calculate log likelihood given quality of top1 and top2, the
-    ratio r and the observed k.
+) -> cython.double:
+    """Calculate log likelihood given the tabulated error rates of
+    top1 and top2 (see tabulate_error_rates), the ratio r and the
+    observed k.
 
     """
-    i: cython.int
     lnL: cython.double
-    e: cython.double
-
-    lnL = 0
 
     # r is extremely high or
     if r > max_allowed_r or r < 1 - max_allowed_r:
-        lnL += k * log(max_allowed_r) + (tn - k) * log(1 - max_allowed_r)
+        lnL = k * log(max_allowed_r) + (tn - k) * log(1 - max_allowed_r)
     else:
-        lnL += k * log(r) + (tn - k) * log(1 - r)
+        lnL = k * log(r) + (tn - k) * log(1 - r)
 
-    # it's entirely biased toward 1 allele
-    if k == 0 or k == tn:
-        pass
-    elif k <= tn / 2:
-        for i in range(k):
-            lnL += log(float(tn - i) / (k - i))
-    else:
-        for i in range(tn - k):
-            lnL += log(float(tn - i) / (tn - k - i))
+    return lnL + calculate_ln_k(tn, e_m, w_m, e_n, w_n, k)
 
-    for i in range(m):
-        e = exp(-me[i] * LN10_tenth)
-        lnL += log((1 - e) * (float(k) / tn) + e * (1 - float(k) / tn))
 
-    for i in range(n):
-        e = exp(-ne[i] * LN10_tenth)
-        lnL += log((1 - e) * (1 - float(k) / tn) + e * (float(k) / tn))
+@cython.cfunc
+@cython.inline
+@cython.nogil
+@cython.exceptval(check=False)
+def calculate_ln_k(
+    tn: cython.int,
+    e_m: cython.double[::1],
+    w_m: cython.double[::1],
+    e_n: cython.double[::1],
+    w_n: cython.double[::1],
+    k: cython.int,
+) -> cython.double:
+    """The part of calculate_ln that only depends on k: log C(tn, k)
+    and the likelihood of the top1 and top2 bases given k.
+
+    """
+    i: cython.int
+    lnL: cython.double
+    p: cython.double
+    one_minus_p: cython.double
+    one_minus_2p: cython.double
+
+    # log C(tn, k); it is 0 when it's entirely biased toward 1 allele
+    lnL = lgamma(tn + 1) - lgamma(k + 1) - lgamma(tn - k + 1)
+
+    # (1-E)*p + E*(1-p) = p + E*(1-2p) for top1, and
+    # (1-E)*(1-p) + E*p = (1-p) - E*(1-2p) for top2
+    p = cython.cast(cython.double, k) / tn
+    one_minus_p = 1.0 - p
+    one_minus_2p = 1.0 - 2.0 * p
+    for i in range(e_m.shape[0]):
+        lnL += w_m[i] * log(p + e_m[i] * one_minus_2p)
+
+    for i in range(e_n.shape[0]):
+        lnL += w_n[i] * log(one_minus_p - e_n[i] * one_minus_2p)
 
     return lnL
 
 
+@cython.cfunc
+@cython.inline
+@cython.nogil
+@cython.exceptval(check=False)
+def calculate_ln_edge(
+    me: cython.uchar[::1], ne: cython.uchar[::1], k_is_zero: cython.bint
+) -> cython.double:
+    """calculate_ln_k for k = 0 (k_is_zero) or k = tn, computed from the
+    Phred scores directly.
+
+    log C(tn, k) is 0 and p = k/tn is 0 or 1 at these ends, so each
+    base contributes either log(E) = Phred * -LN10_tenth or log(1-E).
+    """
+    if k_is_zero:
+        return sum_log1p_m_e(ne) - LN10_tenth * sum_phred(me)
+    else:
+        return sum_log1p_m_e(me) - LN10_tenth * sum_phred(ne)
+
+
 @cython.ccall
 def calculate_GQ(
     lnL1: cython.double, lnL2: cython.double, lnL3: cython.double
@@ -487,25 +698,15 @@ def calculate_GQ(
     L2 = exp(lnL2 - lnL1)
     L3 = exp(lnL3 - lnL1)
 
-    # if L1 > 1:
-    #    L1 = 1
-
-    if L2 > 1:
-        L2 = 1
-    if L3 > 1:
-        L3 = 1
-    # if(L1<1e-110) L1=1e-110;
-    if L2 < 1e-110:
-        L2 = 1e-110
-    if L3 < 1e-110:
-        L3 = 1e-110
+    # clamp L2 and L3 into [1e-110, 1]
+    L2 = fmax(fmin(L2, 1), 1e-110)
+    L3 = fmax(fmin(L3, 1), 1e-110)
 
+    # after the clamps L2 + L3 >= 2e-110 and s <= 3, so tmp is always
+    # above 1e-110 and GQ_score is at most 1096
     s = L1 + L2 + L3
     tmp = (L2 + L3) / s
-    if tmp > 1e-110:
-        GQ_score = (int)(-4.34294 * log(tmp))
-    else:
-        GQ_score = 255
+    GQ_score = cython.cast(cython.int, -4.34294 * log(tmp))
 
     return GQ_score
 
@@ -523,19 +724,13 @@ def calculate_GQ_heterASsig(lnL1: cython.double, lnL2: cython.double) -> cython.
     L1 = 1
     L2 = exp(lnL2 - lnL1)
 
-    # if L1 > 1:
-    #    L1 = 1
-    if L2 > 1:
-        L2 = 1
-    # if L1 < 1e-110:
-    #    L1 = 1e-110
-    if L2 < 1e-110:
-        L2 = 1e-110
+    # clamp L2 into [1e-110, 1]
+    L2 = fmax(fmin(L2, 1), 1e-110)
 
     s = L1 + L2
     tmp = L2 / s
     if tmp > 1e-110:
-        ASsig_score = (int)(-4.34294 * log(tmp))
+        ASsig_score = cython.cast(cython.int, -4.34294 * log(tmp))
     else:
         ASsig_score = 255
 
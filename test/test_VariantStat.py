@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Module Description: Test functions for VariantStat.py
+
+This code is free software; you can redistribute it and/or modify it
+under the terms of the BSD License (see the file LICENSE included with
+the distribution).
+"""
+
+import unittest
+
+import numpy as np
+from MACS3.Signal.VariantStat import (
+    CalModel_Homo,
+    CalModel_Heter_noAS,
+    CalModel_Heter_AS,
+    calculate_GQ,
+    calculate_GQ_heterASsig,
+)
+
+LN10_tenth = 0.23025850929940458
+
+# ------------------------------------
+# Main function
+# ------------------------------------
+
+
+class Test_CalModel(unittest.TestCase):
+    def setUp(self):
+        self.top1_bq_T = np.array([30, 35, 37, 40, 32, 28, 39, 41], dtype="u1")
+        self.top2_bq_T = np.array([25, 33, 38], dtype="u1")
+        self.top1_bq_C = np.array([36, 30, 34, 40], dtype="u1")
+        self.top2_bq_C = np.array([], dtype="u1")
+        self.bqs = (self.top1_bq_T, self.top1_bq_C, self.top2_bq_T, self.top2_bq_C)
+
+    def test_CalModel_Homo(self):
+        # sum of log(1-E) over top1 plus sum of log(E) over top2
+        expect = (
+            np.log1p(-np.exp(self.top1_bq_T * -LN10_tenth)).sum()
+            + np.log1p(-np.exp(self.top1_bq_C * -LN10_tenth)).sum()
+            - LN10_tenth * (self.top2_bq_T.sum() + self.top2_bq_C.sum())
+        )
+        (lnL, BIC) = CalModel_Homo(*self.bqs)
+        self.assertAlmostEqual(lnL, expect, places=9)
+        self.assertAlmostEqual(BIC, -2 * expect, places=9)
+        self.assertAlmostEqual(lnL, -22.110605777350145, places=9)
+
+    def test_CalModel_Homo_minor(self):
+        (lnL, BIC) = CalModel_Homo(
+            self.top2_bq_T, self.top2_bq_C, self.top1_bq_T, self.top1_bq_C
+        )
+        self.assertAlmostEqual(lnL, -97.17291802732483, places=9)
+        self.assertAlmostEqual(BIC, 194.34583605464965, places=9)
+
+    def test_CalModel_Heter_noAS(self):
+        (lnL, BIC) = CalModel_Heter_noAS(*self.bqs)
+        self.assertAlmostEqual(lnL, -11.249415598805932, places=9)
+        self.assertAlmostEqual(BIC, 26.283020831530123, places=9)
+
+    def test_CalModel_Heter_AS(self):
+        (lnL, BIC) = CalModel_Heter_AS(*self.bqs, 0.99)
+        self.assertAlmostEqual(lnL, -10.55551894201081, places=9)
+        self.assertAlmostEqual(BIC, 27.293122790738252, places=9)
+
+    def test_CalModel_Heter_single_read(self):
+        bqs = (
+            self.top1_bq_T[:1],
+            self.top1_bq_C[:0],
+            self.top2_bq_T[:0],
+            self.top2_bq_C,
+        )
+        (lnL, BIC) = CalModel_Heter_noAS(*bqs)
+        self.assertAlmostEqual(lnL, -0.6941476808935289, places=9)
+        self.assertAlmostEqual(BIC, 1.3882953617870577, places=9)
+        (lnL, BIC) = CalModel_Heter_AS(*bqs, 0.99)
+        self.assertAlmostEqual(lnL, -0.011050826554011118, places=9)
+        self.assertAlmostEqual(BIC, 0.022101653108022236, places=9)
+
+    def test_CalModel_Homo_phred_zero(self):
+        # 1-E is 0 for Phred 0, so log(1-E) is -inf
+        bq = np.array([0, 30], dtype="u1")
+        (lnL, BIC) = CalModel_Homo(bq, self.top1_bq_C, self.top2_bq_T, self.top2_bq_C)
+        self.assertEqual(lnL, float("-inf"))
+        self.assertEqual(BIC, float("inf"))
+
+    def test_no_treatment_reads(self):
+        bqs = (self.top1_bq_T[:0], self.top1_bq_C, self.top2_bq_T[:0], self.top2_bq_C)
+        with self.assertRaises(Exception):
+            CalModel_Heter_noAS(*bqs)
+        with self.assertRaises(Exception):
+            CalModel_Heter_AS(*bqs)
+
+
+class Test_GQ(unittest.TestCase):
+    def test_calculate_GQ(self):
+        self.assertEqual(calculate_GQ(-10.5, -20.1, -30.2), 41)
+        self.assertEqual(calculate_GQ(-10.5, -9.0, -300), 3)
+        # both L2 and L3 clamped to 1e-110
+        self.assertEqual(calculate_GQ(0, -1000, -1000), 1096)
+
+    def test_calculate_GQ_heterASsig(self):
+        self.assertEqual(calculate_GQ_heterASsig(-10, -12), 9)
+        self.assertEqual(calculate_GQ_heterASsig(0, -1000), 255)